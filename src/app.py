@@ -6,23 +6,63 @@ Endpoint: GET /recommend?user_id=<int>&n=<int>
 """
 
 from flask import Flask, request, jsonify
+import functools
 import pickle
+import numpy as np
 import pandas as pd
 import os
 from typing import List, Dict
 
+# Optional: FAISS gives a SIMD-optimized inner-product search over the
+# movie vectors; without it we fall back to the plain numpy sweep
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Optional: Numba fuses the per-request clip + seen-movie masking into
+# one compiled pass over the score vector, with no temporaries
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def _clip_and_mask_seen(scores, seen_idx, low, high):
+        """Clip scores to [low, high] in place; mark seen entries -inf."""
+        for i in range(scores.shape[0]):
+            if scores[i] < low:
+                scores[i] = low
+            elif scores[i] > high:
+                scores[i] = high
+        for i in seen_idx:
+            scores[i] = -np.inf
+else:
+    def _clip_and_mask_seen(scores, seen_idx, low, high):
+        """Numpy fallback for the compiled clip + mask kernel."""
+        np.clip(scores, low, high, out=scores)
+        scores[seen_idx] = -np.inf
+
 app = Flask(__name__)
 
 # Global variables for model and data
 model = None
 trainset = None
 movies_df = None
-user_rated_items = None
+movies_lookup = None
+user_seen_idx = None
+faiss_index = None
+
+# Bumped on every (re)load so cached recommendations from an older
+# model version can never be served
+model_version = 0
 
 
 def load_model_and_data():
     """Load the trained model and movie data at startup."""
-    global model, trainset, movies_df, user_rated_items
+    global model, trainset, movies_df, movies_lookup, user_seen_idx, faiss_index
+    global model_version
     
     print("Loading model and data...")
     
@@ -34,80 +74,191 @@ def load_model_and_data():
     
     with open("model.pkl", "rb") as f:
         model = pickle.load(f)
+
+    # Memory-map the factor matrices: the OS page cache backs them, so
+    # startup is near-instant and multiple workers share physical pages
+    model['US'] = np.load("US.npy", mmap_mode='r')
+    model['Vt'] = np.load("Vt.npy", mmap_mode='r')
     print("✓ Model loaded")
     
-    # Load user-rated items mapping (for filtering)
-    with open("user_rated_items.pkl", "rb") as f:
-        user_rated_items = pickle.load(f)
-    print(f"✓ Loaded {len(user_rated_items):,} users' rating history")
+    # Load user -> rated movie indices mapping (for filtering)
+    with open("user_seen_idx.pkl", "rb") as f:
+        user_seen_idx = pickle.load(f)
+    print(f"✓ Loaded {len(user_seen_idx):,} users' rating history")
     
     # Load movies data
     movies_path = os.path.join("ml-latest", "movies.csv")
     movies_df = pd.read_csv(movies_path)
     print(f"✓ Loaded {len(movies_df):,} movies")
-    
+
+    # Hash map movieId -> {title, genres} so formatting a recommendation
+    # is an O(1) lookup instead of a boolean scan over movies_df
+    movies_lookup = movies_df.set_index('movieId')[['title', 'genres']].to_dict('index')
+
+    # Load or build a FAISS index over the movie vectors (rows of Vt.T)
+    # so top-N search uses FAISS's kernels instead of a numpy sweep.
+    # The KNIGHTRECS_INT8 opt-in takes precedence over a prebuilt HNSW
+    # index, which training writes unconditionally when faiss is there.
+    use_int8 = os.environ.get('KNIGHTRECS_INT8') == '1'
+    if faiss is not None and not use_int8 and os.path.exists("hnsw.index"):
+        # HNSW graph prebuilt at training time; memory-mapped so it
+        # shares pages across workers like the factor matrices
+        faiss_index = faiss.read_index("hnsw.index", faiss.IO_FLAG_MMAP)
+        faiss_index.hnsw.efSearch = 64
+        print(f"✓ Loaded HNSW index over {faiss_index.ntotal:,} movie vectors")
+    elif faiss is not None:
+        movie_vecs = np.ascontiguousarray(model['Vt'].T)
+        d = movie_vecs.shape[1]
+        if use_int8:
+            # 8-bit scalar quantization: a quarter of the float32 bytes
+            # streamed per query, served by FAISS's int8 SIMD kernels,
+            # at the cost of slightly approximate scores
+            faiss_index = faiss.IndexScalarQuantizer(
+                d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            faiss_index.train(movie_vecs)
+        else:
+            faiss_index = faiss.IndexFlatIP(d)
+        faiss_index.add(movie_vecs)
+        print(f"✓ Built FAISS index over {faiss_index.ntotal:,} movie vectors")
+
+    model_version += 1
+
     print("Ready to serve recommendations!\n")
 
 
+def _format_recommendations(top_movie_ids, top_scores) -> List[Dict]:
+    """Attach titles/genres to ranked (movieId, score) results."""
+    recommendations = []
+    for movie_id, predicted_rating in zip(top_movie_ids, top_scores):
+        movie_info = movies_lookup.get(int(movie_id))
+        if movie_info is not None:
+            recommendations.append({
+                'movieId': int(movie_id),
+                'title': movie_info['title'],
+                'genres': movie_info['genres'],
+                'predicted_rating': round(float(predicted_rating), 2)
+            })
+    return recommendations
+
+
 def get_recommendations(user_id: int, n: int = 5) -> List[Dict]:
     """
     Generate top-N movie recommendations for a user.
     Exclude movies the user has already rated.
     Return list of dicts with movieId, title, predicted_rating.
     """
-    import numpy as np
-    
-    # Check if user exists in training data
-    if user_id not in user_rated_items:
-        return None
-    
     # Check if user is in model's user mapping
     if user_id not in model['user_to_idx']:
         return None
-    
-    # Get movies the user has already rated
-    seen_movies = user_rated_items[user_id]
-    
+
     # Get user index in model
     user_idx = model['user_to_idx'][user_id]
-    
-    # Get all movie IDs from the model
-    all_movie_ids = model['movie_ids']
-    
-    # Predict ratings for unseen movies
-    predictions = []
-    for movie_id in all_movie_ids:
-        if movie_id not in seen_movies and movie_id in model['movie_to_idx']:
-            # Get movie index
-            movie_idx = model['movie_to_idx'][movie_id]
-            
-            # Predict rating: U[user] * Sigma * Vt[:, movie]
-            pred = np.dot(np.dot(model['U'][user_idx, :], model['sigma']), 
-                          model['Vt'][:, movie_idx])
-            
-            # Clip to valid rating range
-            pred = np.clip(pred, 0.5, 5.0)
-            predictions.append((movie_id, pred))
-    
-    # Sort by predicted rating (descending) and take top N
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    top_predictions = predictions[:n]
-    
+
+    # Column indices of the movies the user has already rated
+    # (precomputed at training time; users with no training ratings
+    # have no history to filter against, so treat them as unknown)
+    if user_idx not in user_seen_idx:
+        return None
+    seen_idx = user_seen_idx[user_idx]
+
+    # Ratings were mean-centered before SVD; the user's mean is added
+    # back to every score (a per-user constant, so rankings are intact)
+    user_mean = model['user_means'][user_idx]
+
+    if faiss_index is not None:
+        # Candidate search via FAISS; over-fetch by the size of the
+        # user's history so filtering seen movies still leaves n.
+        # Copy explicitly: US is a read-only mmap, and normalize_L2
+        # below writes in place (ascontiguousarray would hand back a
+        # read-only view of the already-contiguous row and segfault)
+        uvec = model['US'][user_idx:user_idx + 1, :].copy()
+        if hasattr(faiss_index, 'hnsw'):
+            # The HNSW graph is built over L2-normalized vectors, so
+            # normalize the query to make the walk rank by cosine
+            faiss.normalize_L2(uvec)
+        k_search = min(n + len(seen_idx), faiss_index.ntotal)
+        _, cand_idx = faiss_index.search(uvec, k_search)
+        # seen_idx is stored sorted and unique, so isin can skip its
+        # own dedup/sort pass (HNSW pads short results with -1)
+        cand = cand_idx[0][cand_idx[0] >= 0]
+        top_idx = cand[np.isin(cand, seen_idx, assume_unique=True, invert=True)][:n]
+        # Exact predicted ratings for the short winner list, since the
+        # index may rank by quantized or cosine similarity
+        top_scores = model['US'][user_idx, :] @ model['Vt'][:, top_idx] + user_mean
+        top_scores = np.clip(top_scores, 0.5, 5.0)
+        order = np.argsort(-top_scores)
+        top_idx, top_scores = top_idx[order], top_scores[order]
+    else:
+        # Fallback: score all movies at once with US[user] @ Vt (Sigma is
+        # already folded into US at training time)
+        scores = model['US'][user_idx, :] @ model['Vt'] + user_mean
+
+        # Clip to valid rating range and mask out already-rated movies
+        # (compiled into a single pass when numba is available)
+        _clip_and_mask_seen(scores, seen_idx, 0.5, 5.0)
+
+        # Select the top N in O(N) with argpartition, then sort only
+        # those n candidates instead of the whole movie catalog
+        kth = min(n, scores.shape[0] - 1)
+        top_idx = np.argpartition(-scores, kth)[:n]
+        top_idx = top_idx[np.argsort(-scores[top_idx])]
+        top_idx = top_idx[np.isfinite(scores[top_idx])]
+        top_scores = scores[top_idx]
+
     # Format results with movie titles
-    recommendations = []
-    for movie_id, predicted_rating in top_predictions:
-        movie_info = movies_df[movies_df['movieId'] == movie_id]
-        if not movie_info.empty:
-            title = movie_info.iloc[0]['title']
-            genres = movie_info.iloc[0]['genres']
-            recommendations.append({
-                'movieId': int(movie_id),
-                'title': title,
-                'genres': genres,
-                'predicted_rating': round(float(predicted_rating), 2)
-            })
-    
-    return recommendations
+    return _format_recommendations(model['movie_ids'][top_idx], top_scores)
+
+
+@functools.lru_cache(maxsize=100_000)
+def _get_recommendations_cached(user_id: int, n: int, version: int) -> List[Dict]:
+    """
+    Memoized wrapper around get_recommendations. For a fixed model the
+    result is a pure function of (user_id, n), so repeat hits from the
+    same user cost a dict lookup; keying on the model version makes
+    entries from a previous model miss naturally after a reload.
+    """
+    return get_recommendations(user_id, n)
+
+
+def get_recommendations_batch(user_ids: List[int], n: int = 5) -> Dict[int, List[Dict]]:
+    """
+    Generate top-N recommendations for several users at once.
+    Scores all (user, movie) pairs with a single matrix multiply, which
+    lets BLAS reuse Vt across users instead of re-streaming it per user.
+    Return dict user_id -> recommendations (None for unknown users).
+    """
+    results = {uid: None for uid in user_ids}
+
+    # Keep only users known to the model with training history
+    known = [(uid, model['user_to_idx'][uid]) for uid in dict.fromkeys(user_ids)
+             if uid in model['user_to_idx'] and model['user_to_idx'][uid] in user_seen_idx]
+    if not known:
+        return results
+
+    # One GEMM scores every movie for every requested user, then each
+    # row gets its user's mean rating added back (see train.py)
+    user_idx = np.array([idx for _, idx in known])
+    scores = np.asarray(model['US'][user_idx]) @ model['Vt']
+    scores += model['user_means'][user_idx][:, None]
+    np.clip(scores, 0.5, 5.0, out=scores)
+
+    # Mask out each user's already-rated movies
+    for row, (_, uidx) in enumerate(known):
+        scores[row, user_seen_idx[uidx]] = -np.inf
+
+    # Per-row top-N selection, as in the single-user path
+    kth = min(n, scores.shape[1] - 1)
+    part = np.argpartition(-scores, kth, axis=1)[:, :n]
+    rows = np.arange(part.shape[0])[:, None]
+    top_idx = part[rows, np.argsort(-scores[rows, part], axis=1)]
+
+    for row, (uid, _) in enumerate(known):
+        idx = top_idx[row]
+        idx = idx[np.isfinite(scores[row, idx])]
+        results[uid] = _format_recommendations(model['movie_ids'][idx],
+                                               scores[row, idx])
+
+    return results
 
 
 @app.route('/')
@@ -119,7 +270,8 @@ def home():
         'version': '1.0.0',
         'endpoints': {
             '/': 'Health check',
-            '/recommend': 'Get movie recommendations (params: user_id, n)'
+            '/recommend': 'Get movie recommendations (params: user_id, n)',
+            '/recommend_batch': 'Get recommendations for many users (POST JSON: user_ids, n)'
         }
     })
 
@@ -161,8 +313,8 @@ def recommend():
             'error': 'Parameter n must be between 1 and 100',
         }), 400
     
-    # Get recommendations
-    recommendations = get_recommendations(user_id, n)
+    # Get recommendations (cached per (user_id, n) for the current model)
+    recommendations = _get_recommendations_cached(user_id, n, model_version)
     
     if recommendations is None:
         return jsonify({
@@ -178,10 +330,65 @@ def recommend():
     })
 
 
-if __name__ == '__main__':
-    # Load model and data before starting the server
+@app.route('/recommend_batch', methods=['POST'])
+def recommend_batch():
+    """
+    Return top N movie recommendations for a list of users.
+
+    JSON body:
+    - user_ids (required): List of user IDs (integers, max 1000)
+    - n (optional): Number of recommendations per user (default: 5)
+
+    Example: {"user_ids": [1, 2, 3], "n": 10}
+    """
+    payload = request.get_json(silent=True)
+
+    # Validate user_ids
+    if not payload or 'user_ids' not in payload:
+        return jsonify({
+            'error': 'Missing required field: user_ids',
+            'example': '{"user_ids": [1, 2, 3], "n": 5}'
+        }), 400
+
+    user_ids = payload['user_ids']
+    n = payload.get('n', 5)
+
+    if (not isinstance(user_ids, list)
+            or not all(isinstance(uid, int) for uid in user_ids)
+            or not isinstance(n, int)):
+        return jsonify({
+            'error': 'Invalid field type. user_ids must be a list of integers and n an integer.',
+            'example': '{"user_ids": [1, 2, 3], "n": 5}'
+        }), 400
+
+    # Validate batch size and n
+    if len(user_ids) < 1 or len(user_ids) > 1000:
+        return jsonify({
+            'error': 'Field user_ids must contain between 1 and 1000 users',
+        }), 400
+
+    if n < 1 or n > 100:
+        return jsonify({
+            'error': 'Field n must be between 1 and 100',
+        }), 400
+
+    # Get recommendations for the whole batch in one matrix multiply
+    results = get_recommendations_batch(user_ids, n)
+
+    return jsonify({
+        'results': {str(uid): recs for uid, recs in results.items()},
+        'count': len(results)
+    })
+
+
+# Load at import time so `gunicorn --preload` initializes the model
+# once in the master process; forked workers then share the read-only,
+# file-backed model pages instead of each loading a private copy
+if model is None:
     load_model_and_data()
-    
+
+
+if __name__ == '__main__':
     # Run Flask app
     # CRITICAL: Use host="0.0.0.0" to make it accessible in Docker container
     # Use environment variable for port (default 5000, but can be changed for local testing)